@@ -6,11 +6,20 @@ Fetches papers from Slack, Gmail newsletters, and generates a comprehensive summ
 
 import os
 import re
+import html
 import json
+import email.policy
+import time
 import base64
-import requests
+import hashlib
+import functools
+import asyncio
+import multiprocessing
+import aiohttp
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Set
+from typing import List, Dict, Optional, Set
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import anthropic
 from slack_sdk import WebClient
 from google.oauth2.credentials import Credentials
@@ -20,11 +29,129 @@ from email.mime.multipart import MIMEMultipart
 import smtplib
 
 
+MAX_CONCURRENT_DOWNLOADS = 10  # Be polite to arxiv.org
+MAX_DOWNLOAD_BYTES = 20_000_000  # Only the first ~100k chars of a paper are used anyway
+MAX_PDF_CHARS = 100000  # Limit to ~100k chars
+GRAPHICS_PAGE_MIN_BYTES = 512_000  # Page content streams above this size are checked for text
+GRAPHICS_PAGE_MIN_TEXT_CHARS = 500  # ...and skipped if their text operators show fewer characters than this
+GMAIL_BATCH_SIZE = 50  # Gmail allows 100 calls per batch but recommends at most 50
+SLACK_PAGE_SIZE = 999  # Slack caps list/history pages below 1000 items
+THINKING_MIN_INPUT_TOKENS = 20000  # Below this, Claude answers without extended thinking
+INPUT_TOKEN_BUDGET = 150000  # Leaves room in Claude's 200k context for the response and estimate error
+NEWSLETTER_MAX_TOKENS = 2500  # Limit each newsletter
+PAPER_MAX_TOKENS = 7500  # Limit each paper
+CHARS_PER_TOKEN = 4  # Rough average for English text; corrected with a real token count when over budget
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+
+# Slack wraps links as <url> or <url|label>, so stop at those delimiters
+_URL_RE = re.compile(r'https?://[^\s<>"|]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+_ARXIV_SUFFIX_RE = re.compile(r'(v\d+)?(\.pdf)?/?$')
+_TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref_src'}
+
+# PDF content stream strings, and the operands of the Tj, ', " and TJ text-showing operators.
+# Literal strings may nest one level of balanced parentheses, e.g. (f(x)). Every repeated
+# group starts on a distinct character so a scan stays linear even on malformed streams.
+_PDF_LITERAL = rb'\((?:[^()\\]|\\.|\((?:[^()\\]|\\.)*\))*\)'
+_PDF_HEX = rb'<[0-9A-Fa-f\s]*>'
+_PDF_STRING_RE = re.compile(_PDF_LITERAL + rb'|' + _PDF_HEX, re.S)
+_PDF_TEXT_SHOW_RE = re.compile(
+    rb'\[((?:' + _PDF_LITERAL + rb'|[^\[\]()])*)\]\s*TJ'
+    rb'|(' + _PDF_LITERAL + rb'|' + _PDF_HEX + rb')\s*(?:Tj|\'|")',
+    re.S
+)
+_PDF_HEX_DIGIT_RE = re.compile(rb'[0-9A-Fa-f]')
+
+# Downloaded papers are cached between runs, keyed by URL
+CACHE_DIR = os.path.expanduser(os.environ.get('DIGEST_CACHE_DIR', '~/.cache/ai_safety_digest'))
+CACHE_TTL_SECONDS = 30 * 86400  # Re-download papers after 30 days
+_CACHE_ENTRY_RE = re.compile(r'[0-9a-f]{64}\.json(\.tmp)?$')
+
+
+def _disk_cached(func):
+    """Cache a paper download coroutine's result on disk, keyed by its last argument (the URL)"""
+    @functools.wraps(func)
+    async def wrapper(*args):
+        url = args[-1]
+        path = os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + '.json')
+        
+        # The cache is only an optimization, so unreadable entries count as misses
+        try:
+            if os.path.getmtime(path) > time.time() - CACHE_TTL_SECONDS:
+                with open(path) as f:
+                    cached = json.load(f)
+                print(f"Using cached content for URL: {url}")
+                return cached
+        except (OSError, ValueError):
+            pass
+        
+        result = await func(*args)
+        
+        # Only cache successes so failed downloads are retried next run
+        if result['success']:
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error caching content for URL {url}: {e}")
+        
+        return result
+    return wrapper
+
+
+def _evict_expired_cache():
+    """Delete cached papers older than CACHE_TTL_SECONDS so the cache doesn't grow forever"""
+    cutoff = time.time() - CACHE_TTL_SECONDS
+    try:
+        entries = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    
+    for name in entries:
+        # DIGEST_CACHE_DIR may point at a shared directory, so only touch files this cache wrote
+        if not _CACHE_ENTRY_RE.match(name):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError as e:
+            print(f"Error evicting cache entry {path}: {e}")
+
+
+def _canonicalize_url(url: str) -> str:
+    """Normalize a URL so different links to the same paper compare equal"""
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    path = parts.path
+    query = parts.query
+    
+    # arxiv.org/pdf/2401.00001v2.pdf and arxiv.org/abs/2401.00001 are the same paper
+    if host == 'arxiv.org' or host.endswith('.arxiv.org'):
+        host = 'arxiv.org'
+        path = _ARXIV_SUFFIX_RE.sub('', path.replace('/pdf/', '/abs/', 1))
+        query = ''
+    
+    # Drop tracking parameters, rebuilding the query only if one was present
+    params = parse_qsl(query, keep_blank_values=True)
+    kept = [(key, value) for key, value in params if not key.startswith('utm_') and key not in _TRACKING_PARAMS]
+    if len(kept) < len(params):
+        query = urlencode(kept)
+    
+    # Fragments don't change the content
+    return urlunsplit((parts.scheme.lower(), host, path, query, ''))
+
+
 class ContentFetcher:
     """Handles fetching content from various sources"""
     
     def __init__(self):
         self.slack_token = os.environ.get('SLACK_BOT_TOKEN')
+        self.slack_client = WebClient(token=self.slack_token)
+        self._channel_ids = {}  # Slack channel name -> ID
         self.gmail_creds = self._setup_gmail_credentials()
         self.anthropic_client = anthropic.Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
         
@@ -36,17 +163,27 @@ class ContentFetcher:
             return Credentials.from_authorized_user_info(creds_data)
         return None
     
+    def _get_channel_id(self, channel_name: str) -> Optional[str]:
+        """Resolve a Slack channel name to its ID, paging through the workspace's channels"""
+        if channel_name in self._channel_ids:
+            return self._channel_ids[channel_name]
+        
+        cursor = None
+        while True:
+            channels = self.slack_client.conversations_list(limit=SLACK_PAGE_SIZE, exclude_archived=True, cursor=cursor)
+            for channel in channels['channels']:
+                if channel['name'] == channel_name:
+                    # Only found IDs are remembered, so a missing channel is looked up again next time
+                    self._channel_ids[channel_name] = channel['id']
+                    return channel['id']
+            cursor = channels.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                return None
+    
     def fetch_slack_urls(self, channel_name: str, days_back: int = 7) -> List[str]:
         """Fetch all URLs from Slack channel from the last N days"""
-        client = WebClient(token=self.slack_token)
-        
         # Get channel ID
-        channels = client.conversations_list()
-        channel_id = None
-        for channel in channels['channels']:
-            if channel['name'] == channel_name:
-                channel_id = channel['id']
-                break
+        channel_id = self._get_channel_id(channel_name)
         
         if not channel_id:
             print(f"Channel {channel_name} not found")
@@ -55,28 +192,26 @@ class ContentFetcher:
         # Calculate timestamp for N days ago
         oldest = (datetime.now() - timedelta(days=days_back)).timestamp()
         
-        # Fetch messages
-        result = client.conversations_history(
-            channel=channel_id,
-            oldest=str(oldest)
-        )
-        
-        # Extract all URLs using regex
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = []
-        
-        for message in result['messages']:
-            text = message.get('text', '')
-            found_urls = re.findall(url_pattern, text)
-            urls.extend(found_urls)
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_urls = []
-        for url in urls:
-            if url not in seen:
-                seen.add(url)
-                unique_urls.append(url)
+        # Fetch messages, following the cursor until the whole window is covered
+        messages = []
+        cursor = None
+        while True:
+            result = self.slack_client.conversations_history(
+                channel=channel_id,
+                oldest=str(oldest),
+                limit=SLACK_PAGE_SIZE,
+                cursor=cursor
+            )
+            messages.extend(result['messages'])
+            if not result.get('has_more'):
+                break
+            cursor = result['response_metadata']['next_cursor']
+        
+        # Extract all URLs using regex, undoing Slack's HTML escaping (& arrives as &amp;)
+        urls = [html.unescape(url) for message in messages for url in _URL_RE.findall(message.get('text', ''))]
+        
+        # Remove duplicates (including different links to the same paper) while preserving order
+        unique_urls = list(dict.fromkeys(map(_canonicalize_url, urls)))
         
         print(f"Found {len(unique_urls)} unique URLs from Slack")
         return unique_urls
@@ -97,144 +232,235 @@ class ContentFetcher:
         results = service.users().messages().list(userId='me', q=query).execute()
         messages = results.get('messages', [])
         
-        newsletters = []
-        for msg in messages:
-            full_msg = service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
+        # First pass: fetch headers only, so filtered-out messages never have their bodies downloaded
+        subjects = {}
+        
+        def add_metadata(request_id, msg, exception):
+            if exception is not None:
+                print(f"Error fetching message {request_id}: {exception}")
+                return
             
-            # Extract subject
-            subject = ''
-            for header in full_msg['payload']['headers']:
-                if header['name'] == 'Subject':
-                    subject = header['value']
-                    break
+            headers = {header['name'].lower(): header['value'] for header in msg['payload']['headers']}
+            
+            # Skip auto-replies such as out-of-office and vacation responses (RFC 3834)
+            if headers.get('auto-submitted', '').lower().startswith('auto-replied'):
+                return
+            
+            subjects[msg['id']] = headers.get('subject', '')
+        
+        self._batch_get_messages(service, [msg['id'] for msg in messages], add_metadata,
+                                 format='metadata', metadataHeaders=['Subject', 'Auto-Submitted'])
+        
+        # Second pass: fetch full messages for the ones that survived filtering
+        newsletters = []
+        
+        def add_newsletter(request_id, full_msg, exception):
+            if exception is not None:
+                print(f"Error fetching message {request_id}: {exception}")
+                return
             
             # Extract body
-            body = self._get_email_body(full_msg['payload'])
+            body = self._get_email_body(full_msg['raw'])
             
             newsletters.append({
-                'subject': subject,
+                'subject': subjects[full_msg['id']],
                 'body': body,
-                'id': msg['id']
+                'id': full_msg['id']
             })
         
+        self._batch_get_messages(service, list(subjects), add_newsletter, format='raw')
+        
         print(f"Found {len(newsletters)} newsletters from Gmail")
         return newsletters
     
-    def _get_email_body(self, payload):
-        """Extract email body from Gmail message payload"""
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    data = part['body'].get('data', '')
-                    if data:
-                        return base64.urlsafe_b64decode(data).decode('utf-8')
-                elif part['mimeType'] == 'text/html':
-                    data = part['body'].get('data', '')
-                    if data:
-                        return base64.urlsafe_b64decode(data).decode('utf-8')
-        else:
-            data = payload['body'].get('data', '')
-            if data:
-                return base64.urlsafe_b64decode(data).decode('utf-8')
-        return ''
+    def _batch_get_messages(self, service, message_ids: List[str], callback, **params):
+        """Fetch Gmail messages in batches instead of one request per message"""
+        for i in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for message_id in message_ids[i:i + GMAIL_BATCH_SIZE]:
+                batch.add(service.users().messages().get(userId='me', id=message_id, **params), request_id=message_id)
+            batch.execute()
+    
+    def _get_email_body(self, raw: str) -> str:
+        """Extract email body from a raw (base64url-encoded) Gmail message"""
+        # Let the email package walk arbitrarily nested multiparts, preferring plain text over HTML
+        msg = email.message_from_bytes(base64.urlsafe_b64decode(raw), policy=email.policy.default)
+        body = msg.get_body(preferencelist=('plain', 'html'))
+        return body.get_content() if body else ''
+    
+    def download_papers(self, urls: List[str]) -> List[Dict]:
+        """Download and extract content from paper URLs concurrently"""
+        _evict_expired_cache()
+        return asyncio.run(self._download_all(urls))
     
-    def download_paper_content(self, url: str) -> Dict:
+    async def _download_all(self, urls: List[str]) -> List[Dict]:
+        """Fetch all URLs over a shared session and extract them across CPU cores"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        # Spawn rather than fork workers: the pool starts after aiohttp's resolver threads exist,
+        # and forking a multi-threaded process can deadlock the child
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn')) as pool:
+            async with aiohttp.ClientSession(
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=aiohttp.ClientTimeout(total=30),
+                connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS)
+            ) as session:
+                return await asyncio.gather(*[
+                    self.download_paper_content(session, semaphore, pool, url) for url in urls
+                ])
+    
+    @_disk_cached
+    async def download_paper_content(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                                     pool: ProcessPoolExecutor, url: str) -> Dict:
         """Download and extract content from a paper URL"""
         print(f"Processing URL: {url}")
         
         # Handle arXiv URLs - convert to PDF
         if 'arxiv.org' in url:
             if '/abs/' in url:
-                pdf_url = url.replace('/abs/', '/pdf/') + '.pdf'
+                fetch_url = url.replace('/abs/', '/pdf/') + '.pdf'
             elif '/pdf/' in url:
-                pdf_url = url if url.endswith('.pdf') else url + '.pdf'
+                fetch_url = url if url.endswith('.pdf') else url + '.pdf'
             else:
-                pdf_url = url
-            
-            return self._download_pdf(pdf_url, url)
+                fetch_url = url
+            content_type = 'pdf'
         
         # Handle direct PDF links
         elif url.endswith('.pdf'):
-            return self._download_pdf(url, url)
+            fetch_url = url
+            content_type = 'pdf'
         
         # Handle web pages (OpenReview, blogs, etc.)
         else:
-            return self._fetch_webpage(url)
-    
-    def _download_pdf(self, pdf_url: str, original_url: str) -> Dict:
-        """Download PDF and convert to text"""
+            fetch_url = url
+            content_type = 'webpage'
+        
         try:
-            response = requests.get(pdf_url, timeout=30)
-            response.raise_for_status()
-            
-            # Save PDF temporarily
-            pdf_path = '/tmp/temp_paper.pdf'
-            with open(pdf_path, 'wb') as f:
-                f.write(response.content)
-            
-            # Convert PDF to text using pdfplumber
-            import pdfplumber
-            text = ""
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
-            
-            # Clean up
-            os.remove(pdf_path)
-            
-            return {
-                'url': original_url,
-                'type': 'pdf',
-                'content': text[:100000],  # Limit to ~100k chars
-                'success': True
-            }
+            async with semaphore:
+                data = await self.fetch_bytes(session, fetch_url)
         except Exception as e:
-            print(f"Error downloading PDF {pdf_url}: {e}")
+            print(f"Error downloading {content_type} {fetch_url}: {e}")
             return {
-                'url': original_url,
-                'type': 'pdf',
+                'url': url,
+                'type': content_type,
                 'content': '',
                 'success': False,
                 'error': str(e)
             }
+        
+        # Extraction is CPU-bound, so run it in a worker process
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, extract_text, data, url, content_type)
     
-    def _fetch_webpage(self, url: str) -> Dict:
-        """Fetch content from a webpage"""
-        try:
-            response = requests.get(url, timeout=30, headers={'User-Agent': 'Mozilla/5.0'})
+    async def fetch_bytes(self, session: aiohttp.ClientSession, url: str) -> bytes:
+        """Download the raw response body for a URL, refusing bodies over MAX_DOWNLOAD_BYTES"""
+        async with session.get(url) as response:
             response.raise_for_status()
+            if (response.content_length or 0) > MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"Response too large ({response.content_length} bytes)")
             
-            # Basic HTML cleaning
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # Get text
-            text = soup.get_text()
-            
-            # Clean up whitespace
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            
-            return {
-                'url': url,
-                'type': 'webpage',
-                'content': text[:50000],  # Limit content
-                'success': True
-            }
-        except Exception as e:
-            print(f"Error fetching webpage {url}: {e}")
-            return {
-                'url': url,
-                'type': 'webpage',
-                'content': '',
-                'success': False,
-                'error': str(e)
-            }
+            # Stream the body so oversized responses without a Content-Length are cut off early
+            buf = bytearray()
+            async for chunk in response.content.iter_chunked(1 << 16):
+                buf.extend(chunk)
+                if len(buf) > MAX_DOWNLOAD_BYTES:
+                    raise ValueError(f"Response exceeds {MAX_DOWNLOAD_BYTES} bytes")
+            return bytes(buf)
+
+
+def extract_text(data: bytes, url: str, content_type: str) -> Dict:
+    """Extract text from downloaded PDF or HTML bytes (runs in a worker process)"""
+    try:
+        if content_type == 'pdf':
+            content = _pdf_to_text(data)[:MAX_PDF_CHARS]
+        else:
+            content = _html_to_text(data)[:50000]  # Limit content
+        
+        return {
+            'url': url,
+            'type': content_type,
+            'content': content,
+            'success': True
+        }
+    except Exception as e:
+        print(f"Error extracting {content_type} {url}: {e}")
+        return {
+            'url': url,
+            'type': content_type,
+            'content': '',
+            'success': False,
+            'error': str(e)
+        }
+
+
+def _pdf_to_text(data: bytes) -> str:
+    """Convert PDF bytes to text"""
+    # Convert PDF to text using PyMuPDF, straight from memory
+    import fitz
+    doc = fitz.open(stream=data, filetype="pdf")
+    
+    # Collect pages and join once; stop as soon as there is enough text to fill the limit
+    pages = []
+    size = 0
+    for page in doc:
+        if _is_graphics_page(page):
+            continue
+        text = page.get_text("text")
+        pages.append(text)
+        size += len(text)
+        if size >= MAX_PDF_CHARS:
+            break
+    doc.close()
+    
+    return "".join(pages)
+
+
+def _is_graphics_page(page) -> bool:
+    """Detect pages whose content stream is huge but shows very little text (e.g. dense plots)"""
+    contents = page.read_contents()
+    if len(contents) < GRAPHICS_PAGE_MIN_BYTES:
+        return False
+    
+    # Add up the strings shown by text operators, far cheaper than letting MuPDF interpret the whole stream
+    text_chars = 0
+    for match in _PDF_TEXT_SHOW_RE.finditer(contents):
+        text_chars += _pdf_string_chars(match.group(1) or match.group(2))
+        if text_chars >= GRAPHICS_PAGE_MIN_TEXT_CHARS:
+            return False
+    return True
+
+
+def _pdf_string_chars(operands: bytes) -> int:
+    """Approximate the number of characters in PDF string operands, e.g. (text) or <48656c6c6f>"""
+    total = 0
+    for string in _PDF_STRING_RE.findall(operands):
+        if string.startswith(b'('):
+            total += len(string) - 2
+        else:
+            total += len(_PDF_HEX_DIGIT_RE.findall(string)) // 2
+    return total
+
+
+def _html_to_text(data: bytes) -> str:
+    """Convert HTML to cleaned-up text"""
+    # Basic HTML cleaning
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(data, 'lxml')
+    
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+    
+    # Get text and collapse whitespace runs in one pass
+    return _WHITESPACE_RE.sub(' ', soup.get_text(' ', strip=True)).strip()
+
+
+def _truncate_middle(text: str, max_tokens: int, chars_per_token: float) -> str:
+    """Trim text to roughly max_tokens, keeping the beginning and end (e.g. abstract and conclusion)"""
+    max_chars = int(max_tokens * chars_per_token)
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return text[:half] + "\n[...]\n" + text[-half:]
 
 
 class DigestGenerator:
@@ -245,6 +471,55 @@ class DigestGenerator:
     
     def generate_digest(self, papers: List[Dict], newsletters: List[Dict]) -> str:
         """Generate comprehensive weekly digest using Claude"""
+        prompt = self._build_prompt(papers, newsletters, CHARS_PER_TOKEN)
+        
+        # The chars-per-token estimate is too generous for dense text such as math, so count
+        # the real tokens once and, if over budget, rebuild the prompt at the measured density
+        input_tokens = self.client.messages.count_tokens(
+            model=CLAUDE_MODEL,
+            messages=[{"role": "user", "content": prompt}]
+        ).input_tokens
+        if input_tokens > INPUT_TOKEN_BUDGET:
+            chars_per_token = len(prompt) / input_tokens
+            print(f"Prompt is {input_tokens} tokens, truncating at {chars_per_token:.2f} chars per token")
+            prompt = self._build_prompt(papers, newsletters, chars_per_token)
+        
+        print("Sending content to Claude for analysis...")
+        
+        request = {
+            "model": CLAUDE_MODEL,
+            "max_tokens": 16000,
+            "messages": [{
+                "role": "user",
+                "content": prompt
+            }]
+        }
+        
+        # Extended thinking only pays for itself on heavy weeks; skip it for light content
+        if input_tokens >= THINKING_MIN_INPUT_TOKENS:
+            request["thinking"] = {
+                "type": "enabled",
+                "budget_tokens": 10000
+            }
+        
+        # Stream the response so long generations are not cut off by request timeouts
+        with self.client.messages.stream(**request) as stream:
+            message = stream.get_final_message()
+        
+        # Extract the text response (skip thinking blocks)
+        digest_text = ""
+        for block in message.content:
+            if block.type == "text":
+                digest_text += block.text
+        
+        return digest_text
+    
+    def _build_prompt(self, papers: List[Dict], newsletters: List[Dict], chars_per_token: float) -> str:
+        """Assemble the digest prompt, truncating each item to its share of the input budget"""
+        
+        # Split the input budget across all items so long weeks still fit in Claude's context
+        item_count = len(newsletters) + sum(1 for p in papers if p['success'])
+        item_budget = INPUT_TOKEN_BUDGET // max(1, item_count)
         
         # Prepare content for Claude
         content_parts = []
@@ -254,7 +529,7 @@ class DigestGenerator:
             content_parts.append("=== EMAIL NEWSLETTERS ===\n")
             for i, newsletter in enumerate(newsletters, 1):
                 content_parts.append(f"\n--- Newsletter {i}: {newsletter['subject']} ---\n")
-                content_parts.append(newsletter['body'][:10000])  # Limit each newsletter
+                content_parts.append(_truncate_middle(newsletter['body'], min(NEWSLETTER_MAX_TOKENS, item_budget), chars_per_token))
         
         # Add papers
         if papers:
@@ -263,7 +538,7 @@ class DigestGenerator:
                 if paper['success']:
                     content_parts.append(f"\n--- Paper {i}: {paper['url']} ---\n")
                     content_parts.append(f"Type: {paper['type']}\n")
-                    content_parts.append(paper['content'][:30000])  # Limit each paper
+                    content_parts.append(_truncate_middle(paper['content'], min(PAPER_MAX_TOKENS, item_budget), chars_per_token))
                 else:
                     content_parts.append(f"\n--- Paper {i}: {paper['url']} (failed to fetch) ---\n")
         
@@ -292,30 +567,8 @@ Here is this week's content:
 {full_content}
 
 Generate the compact weekly digest now:"""
-
-        print("Sending content to Claude for analysis...")
-        
-        # Send to Claude API with extended thinking
-        message = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=16000,
-            thinking={
-                "type": "enabled",
-                "budget_tokens": 10000
-            },
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }]
-        )
         
-        # Extract the text response (skip thinking blocks)
-        digest_text = ""
-        for block in message.content:
-            if block.type == "text":
-                digest_text += block.text
-        
-        return digest_text
+        return prompt
 
 
 class EmailSender:
@@ -341,8 +594,8 @@ class EmailSender:
         text_part = MIMEText(digest_content, 'plain')
         msg.attach(text_part)
         
-        # Convert to simple HTML
-        html_content = digest_content.replace('\n', '<br>')
+        # Convert to simple HTML (<pre> keeps the line breaks; escape so titles with < or > render)
+        html_content = html.escape(digest_content)
         html_part = MIMEText(f'<html><body><pre style="font-family: sans-serif;">{html_content}</pre></body></html>', 'html')
         msg.attach(html_part)
         
@@ -380,10 +633,7 @@ def main():
     newsletters = fetcher.fetch_gmail_newsletters(gmail_label, days_back)
     
     print("\n3. Downloading paper content...")
-    papers = []
-    for url in slack_urls[:50]:  # Limit to 50 papers to avoid overwhelming
-        paper_content = fetcher.download_paper_content(url)
-        papers.append(paper_content)
+    papers = fetcher.download_papers(slack_urls[:50])  # Limit to 50 papers to avoid overwhelming
     
     print(f"\n4. Successfully processed {sum(1 for p in papers if p['success'])} papers")
     